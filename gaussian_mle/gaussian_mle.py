@@ -8,8 +8,8 @@ class GaussianMLE(object):
         self.X = X
         self.N = X.shape[1]
         self.M = X.shape[0]
-        self.mu = np.zeros(X.shape[1], dtype=np.float)
-        self.sigma = np.zeros((X.shape[1],X.shape[1]), dtype=np.float)
+        self.mu = np.zeros(X.shape[1], dtype=np.float64)
+        self.sigma = np.zeros((X.shape[1],X.shape[1]), dtype=np.float64)
         self.fit = False
         # index mask for conditional probability
         self.mask = np.ones(X.shape[1], dtype=bool)
@@ -18,7 +18,7 @@ class GaussianMLE(object):
 
     def _mean(self):
         # estimate the sample mean for each variable
-        mean = np.mean(self.X, axis=0, dtype=np.float)
+        mean = np.mean(self.X, axis=0, dtype=np.float64)
         self.mu = mean
         return mean
 